@@ -1,7 +1,34 @@
 from PIL import Image
-import numpy as np
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from ocr_handler import OCRHandler
-from text_categorizer import TextCategorizer
+from text_categorizer import TextCategorizer, init_chunk_worker
+from memory_budget import PNG_WRITABLE_MODES
+
+# Long documents are categorized across worker processes when OCR_CATEGORIZE_WORKERS > 1.
+# Off by default: the speedup has not been measured on multi-core hardware yet.
+CATEGORIZE_WORKERS = int(os.environ.get('OCR_CATEGORIZE_WORKERS', 1))
+PARALLEL_MIN_LINES = int(os.environ.get('OCR_PARALLEL_MIN_LINES', 2000))
+
+_categorize_executor = None
+_categorize_executor_lock = threading.Lock()
+
+
+def get_categorize_executor():
+    """Process pool shared by all requests, created on first use"""
+    global _categorize_executor
+    with _categorize_executor_lock:
+        if _categorize_executor is None:
+            # spawn: the server process already runs threads, which fork does not copy safely
+            _categorize_executor = ProcessPoolExecutor(
+                max_workers=CATEGORIZE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_chunk_worker,
+            )
+        return _categorize_executor
+
 
 class DocumentProcessor:
     def __init__(self):
@@ -37,29 +64,42 @@ class DocumentProcessor:
         """
         For simplicity, just return the image without cropping.
         In production, you'd want to add proper document detection.
+        The decoded PIL image is returned as-is; converting it to an array
+        would keep a second full copy of the pixels alive during OCR.
+        Modes that cannot be saved as PNG (e.g. CMYK) are converted to RGB.
         """
         from PIL import Image
-        return np.array(Image.open(image_path))
+        image = Image.open(image_path)
+        # load() decodes the pixels and closes the file for single-frame images
+        image.load()
+        if image.mode not in PNG_WRITABLE_MODES:
+            converted = image.convert('RGB')
+            image.close()
+            image = converted
+        return image
 
     def extract_text(self, image, lang='eng', return_regions=False):
         """Extract text using pytesseract"""
         try:
             if isinstance(image, str):
-                from PIL import Image
-                image = np.array(Image.open(image))
+                image = self.detect_and_crop(image)
             
             return self.ocr_handler.extract_text_with_tesseract(image, lang=lang, return_regions=return_regions)
         except Exception as e:
             print(f"OCR extraction failed: {e}")
             return "OCR extraction failed", {}, []
 
-    def categorize_text(self, text):
-        """Categorize extracted text"""
+    def categorize_text(self, text, fields=None):
+        """Categorize extracted text, optionally limited to the given fields"""
         try:
-            return self.text_categorizer.categorize_text(text)
+            if CATEGORIZE_WORKERS > 1 and text.count('\n') >= PARALLEL_MIN_LINES:
+                return self.text_categorizer.categorize_text_parallel(
+                    text, workers=CATEGORIZE_WORKERS, fields=fields, executor=get_categorize_executor()
+                )
+            return self.text_categorizer.categorize_text(text, fields=fields)
         except Exception as e:
             print(f"Text categorization failed: {e}")
-            return {
+            fallback = {
                 'title': [],
                 'date': [],
                 'name': [],
@@ -73,3 +113,6 @@ class DocumentProcessor:
                 'other': [],
                 'document_type': 'unknown'
             }
+            if fields is not None:
+                fallback = {key: value for key, value in fallback.items() if key in fields}
+            return fallback
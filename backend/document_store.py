@@ -0,0 +1,244 @@
+"""
+SQLite-backed store of processed documents.
+
+Every categorized result is kept with its OCR text. An FTS5 index covers the
+text, and (field, value) rows with a B-tree index cover the extracted fields.
+Inserts and updates are queued and written in batches by a background
+thread, so the upload path only pays for a queue put. The queue is bounded;
+when the writer falls behind, uploads wait for room instead of piling
+every OCR text up in memory.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Categorization fields that get an exact-match index
+INDEXED_FIELDS = ['tax_id', 'invoice_number', 'date', 'amount']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    document_id TEXT UNIQUE,
+    created_at TEXT NOT NULL,
+    filename TEXT,
+    document_type TEXT,
+    text TEXT NOT NULL,
+    result TEXT NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_documents_type ON documents (document_type, id);
+
+CREATE TABLE IF NOT EXISTS document_fields (
+    doc_rowid INTEGER NOT NULL REFERENCES documents (id),
+    field TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_document_fields_lookup ON document_fields (field, value, doc_rowid);
+
+-- trigram rather than unicode61, which splits Thai words at combining vowels and tone marks
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5 (
+    text, content='documents', content_rowid='id', tokenize='trigram'
+);
+"""
+
+
+class DocumentStore:
+    def __init__(self, path=None, batch_size=None, flush_interval=None, max_queue=None):
+        self.path = path or os.environ.get('DOCUMENT_DB_PATH', 'documents.db')
+        self.batch_size = batch_size or int(os.environ.get('DOCUMENT_DB_BATCH_SIZE', 200))
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.environ.get('DOCUMENT_DB_FLUSH_SECONDS', 0.5))
+        self.max_queue = max_queue or int(os.environ.get('DOCUMENT_DB_MAX_QUEUE', 1000))
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'documents_fts'").fetchone()
+            retokenize = row is not None and 'trigram' not in row[0]
+            if retokenize:
+                # Databases created before the trigram tokenizer get their index rebuilt once
+                conn.execute("DROP TABLE documents_fts")
+            conn.executescript(SCHEMA)
+            columns = [column[1] for column in conn.execute("PRAGMA table_info(documents)")]
+            if 'complete' not in columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+            if retokenize:
+                conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+
+        self._local = threading.local()
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._writer = threading.Thread(target=self._write_loop, name='document-store-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self):
+        # sqlite3 connections cannot be shared across threads, so readers get one each
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def add(self, document_id, result, text, filename=None, complete=True):
+        """
+        Queue a processed document for the next batch insert, waiting while
+        the queue is full. Pass complete=False for a fields= result; the row
+        is then only searchable on the categories it has until update() fills
+        it in (see incomplete_ids).
+        """
+        self._queue.put(('insert', document_id, datetime.now().isoformat(), filename, result, text, complete))
+
+    def update(self, document_id, result):
+        """Queue a new full categorization for an already stored document"""
+        self._queue.put(('update', document_id, result))
+
+    def incomplete_ids(self):
+        """Ids of documents stored from a fields= result and not re-categorized since"""
+        rows = self._reader().execute("SELECT document_id FROM documents WHERE complete = 0 ORDER BY id").fetchall()
+        return [row['document_id'] for row in rows]
+
+    def flush(self):
+        """Block until every queued document has been written"""
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+
+            # Gather whatever else arrives within the flush interval into one transaction
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write_batch(conn, batch)
+            except Exception as e:
+                # The transaction rolled back; write the documents one at a time so one bad
+                # document or a lock timeout on the batch does not discard the rest
+                print(f"⚠️ Failed to store a batch of {len(batch)} documents, retrying one by one: {e}")
+                for item in batch:
+                    try:
+                        self._write_batch(conn, [item])
+                    except Exception as e:
+                        print(f"❌ Failed to store document {item[1]}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                self._queue.task_done()
+                break
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        with conn:
+            for item in batch:
+                if item[0] == 'insert':
+                    self._insert(conn, *item[1:])
+                else:
+                    self._update(conn, *item[1:])
+
+    def _insert(self, conn, document_id, created_at, filename, result, text, complete):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO documents (document_id, created_at, filename, document_type, text, result, complete) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (document_id, created_at, filename, _document_type(result),
+             text, json.dumps(result, ensure_ascii=False), int(complete)),
+        )
+        if cursor.rowcount == 0:
+            # Already stored
+            return
+        rowid = cursor.lastrowid
+        conn.execute("INSERT INTO documents_fts (rowid, text) VALUES (?, ?)", (rowid, text))
+        self._insert_fields(conn, rowid, result)
+
+    def _update(self, conn, document_id, result):
+        row = conn.execute("SELECT id FROM documents WHERE document_id = ?", (document_id,)).fetchone()
+        if row is None:
+            # Never stored here (e.g. uploaded before the database existed); nothing to update
+            return
+        rowid = row[0]
+        conn.execute(
+            "UPDATE documents SET document_type = ?, result = ?, complete = 1 WHERE id = ?",
+            (_document_type(result), json.dumps(result, ensure_ascii=False), rowid),
+        )
+        conn.execute("DELETE FROM document_fields WHERE doc_rowid = ?", (rowid,))
+        self._insert_fields(conn, rowid, result)
+
+    def _insert_fields(self, conn, rowid, result):
+        conn.executemany(
+            "INSERT INTO document_fields (doc_rowid, field, value) VALUES (?, ?, ?)",
+            [(rowid, field, str(value))
+             for field in INDEXED_FIELDS
+             for value in set(result.get(field) or [])],
+        )
+
+    def search(self, q=None, document_type=None, fields=None, limit=20, cursor=None):
+        """
+        Return newest-first documents matching an FTS query, a document type and
+        exact field values. Pass the returned next_cursor to get the next page.
+        """
+        where = []
+        params = []
+        if q:
+            where.append("d.id IN (SELECT rowid FROM documents_fts WHERE documents_fts MATCH ?)")
+            params.append(q)
+        for field, value in (fields or {}).items():
+            if field not in INDEXED_FIELDS:
+                raise ValueError(f"Field is not indexed: {field}")
+            where.append("d.id IN (SELECT doc_rowid FROM document_fields WHERE field = ? AND value = ?)")
+            params.extend([field, value])
+        if document_type:
+            where.append("d.document_type = ?")
+            params.append(document_type)
+        if cursor is not None:
+            where.append("d.id < ?")
+            params.append(cursor)
+
+        sql = "SELECT d.id, d.document_id, d.created_at, d.filename, d.document_type, d.result, d.complete FROM documents d"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY d.id DESC LIMIT ?"
+        params.append(limit)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        documents = [{
+            'document_id': row['document_id'],
+            'created_at': row['created_at'],
+            'filename': row['filename'],
+            'document_type': row['document_type'],
+            'result': json.loads(row['result']),
+            'complete': bool(row['complete']),
+        } for row in rows]
+        next_cursor = rows[-1]['id'] if len(rows) == limit else None
+        return {'documents': documents, 'next_cursor': next_cursor}
+
+
+def _document_type(result):
+    document_type = result.get('document_type')
+    return document_type if isinstance(document_type, str) else None
@@ -0,0 +1,340 @@
+"""
+Asyncio load generator for the OCR API.
+
+Drives /upload and /upload-with-export with a mix of PDFs and images and
+reports throughput, latency percentiles, error rate and peak RSS as JSON.
+Every upload carries a unique pixel nonce so the server's single-flight OCR
+coalescing does not collapse the load; pass --allow-coalescing to send
+identical payloads instead.
+
+Examples:
+    # In-process against the ASGI app with a 300ms fake OCR backend
+    python loadtest.py --mode inprocess --concurrency 8 --duration 30
+
+    # Local uvicorn with 4 workers
+    python loadtest.py --mode uvicorn --workers 4 --concurrency 32 --duration 60
+
+    # An already running server (RSS is not reported)
+    python loadtest.py --mode url --url http://localhost:8000
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_TEXT = [
+    "TAX INVOICE",
+    "Invoice No: INV-2024-0042",
+    "Date: 15/05/2024",
+    "Customer: John Doe",
+    "Total Amount: $1,250.00",
+]
+
+
+def make_image_payload(width=1240, height=1754, nonce=None):
+    """Render a simple invoice-like PNG, with the nonce encoded in the top-left pixel"""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(SAMPLE_TEXT):
+        draw.text((60, 60 + 40 * i), line, fill='black')
+    if nonce is not None:
+        image.putpixel((0, 0), tuple(nonce.to_bytes(3, 'big')))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def make_pdf_payload(nonce=None):
+    """Render a single-page A4 PDF with the same text, plus the nonce in the footer"""
+    import fitz
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    for i, line in enumerate(SAMPLE_TEXT):
+        page.insert_text((50, 60 + 20 * i), line, fontsize=11)
+    if nonce is not None:
+        # Rendered text, not metadata: the server keys coalescing on decoded pixels
+        page.insert_text((50, 820), f"Ref {nonce}", fontsize=6)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples, elapsed):
+    """Turn (endpoint, latency, ok) samples into the report block"""
+    latencies = sorted(s[1] * 1000 for s in samples)
+    errors = sum(1 for s in samples if not s[2])
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'throughput_rps': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+
+
+def read_tree_memory_kb(pid, key='VmRSS'):
+    """
+    Sum a /proc status field (VmRSS: current, VmHWM: own peak) over a process
+    and all of its children, in KB
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith(f'{key}:'):
+                        total += int(line.split()[1])
+                        break
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.samples = []
+        self.nonce = 0
+        self.payloads = {
+            'pdf': ('load_test.pdf', make_pdf_payload(), 'application/pdf'),
+            'image': ('load_test.png', make_image_payload(*args.image_size), 'image/png'),
+        }
+
+    def make_payload(self, kind, nonce):
+        filename, _, content_type = self.payloads[kind]
+        if kind == 'pdf':
+            return filename, make_pdf_payload(nonce), content_type
+        return filename, make_image_payload(*self.args.image_size, nonce=nonce), content_type
+
+    async def pick_request(self):
+        endpoint = '/upload-with-export' if random.random() < self.args.export_ratio else '/upload'
+        kind = 'pdf' if random.random() < self.args.pdf_ratio else 'image'
+        if self.args.allow_coalescing:
+            return endpoint, self.payloads[kind]
+        self.nonce = (self.nonce + 1) % (1 << 24)
+        # Rendering is CPU work; keep it off the loop that times the requests
+        return endpoint, await asyncio.to_thread(self.make_payload, kind, self.nonce)
+
+    async def send(self, client, endpoint, payload):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = await client.post(endpoint, files={'file': payload})
+            ok = response.status_code < 400
+            if ok and endpoint == '/upload-with-export':
+                ok = not response.json().get('error')
+        except Exception as e:
+            print(f"⚠️ Request to {endpoint} failed: {e}", file=sys.stderr)
+        return time.perf_counter() - start, ok
+
+    async def worker(self, client, deadline, record_after):
+        while time.perf_counter() < deadline:
+            endpoint, payload = await self.pick_request()
+            latency, ok = await self.send(client, endpoint, payload)
+            if time.perf_counter() - latency >= record_after:
+                self.samples.append((endpoint, latency, ok))
+
+    async def run(self, client):
+        start = time.perf_counter()
+        record_after = start + self.args.warmup
+        deadline = record_after + self.args.duration
+        await asyncio.gather(*[
+            self.worker(client, deadline, record_after) for _ in range(self.args.concurrency)
+        ])
+        return time.perf_counter() - record_after
+
+    def report(self, elapsed, memory):
+        report = summarize(self.samples, elapsed)
+        report['by_endpoint'] = {
+            endpoint: summarize([s for s in self.samples if s[0] == endpoint], elapsed)
+            for endpoint in sorted({s[0] for s in self.samples})
+        }
+        report.update(memory)
+        report['config'] = {
+            'mode': self.args.mode,
+            'workers': self.args.workers if self.args.mode == 'uvicorn' else None,
+            'concurrency': self.args.concurrency,
+            'duration_s': self.args.duration,
+            'warmup_s': self.args.warmup,
+            'pdf_ratio': self.args.pdf_ratio,
+            'export_ratio': self.args.export_ratio,
+            'ocr_latency_ms': self.args.ocr_latency_ms,
+            'ocr_jitter_ms': self.args.ocr_jitter_ms,
+            'allow_coalescing': self.args.allow_coalescing,
+        }
+        return report
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fake_ocr_env(args):
+    env = dict(os.environ)
+    env.update({
+        'OCR_BACKEND': 'fake',
+        'OCR_FAKE_LATENCY_MS': str(args.ocr_latency_ms),
+        'OCR_FAKE_JITTER_MS': str(args.ocr_jitter_ms),
+    })
+    return env
+
+
+async def run_inprocess(test, workdir):
+    os.environ.update(fake_ocr_env(test.args))
+    sys.path.insert(0, BACKEND_DIR)
+    # /upload-with-export writes JSON files into the working directory
+    os.chdir(workdir)
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://loadtest', timeout=None) as client:
+        elapsed = await test.run(client)
+    # One process: its high-water mark is the real peak
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, {'peak_rss_mb': peak_rss_kb / 1024}
+
+
+async def wait_until_healthy(client, process, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            if (await client.get('/health')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn did not become healthy in time")
+
+
+async def run_uvicorn(test, workdir):
+    args = test.args
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', BACKEND_DIR,
+         '--host', '127.0.0.1', '--port', str(port), '--workers', str(args.workers),
+         '--log-level', 'warning'],
+        cwd=workdir,
+        env=fake_ocr_env(args),
+    )
+    peak_total_kb = 0
+    sampling = True
+
+    async def sample_total_rss():
+        # Per-process peaks need not coincide, so the tree total is sampled over time
+        nonlocal peak_total_kb
+        while sampling:
+            peak_total_kb = max(peak_total_kb, read_tree_memory_kb(process.pid, 'VmRSS'))
+            await asyncio.sleep(args.rss_sample_interval)
+
+    try:
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=None) as client:
+            await wait_until_healthy(client, process)
+            sampler = asyncio.create_task(sample_total_rss())
+            try:
+                elapsed = await test.run(client)
+            finally:
+                sampling = False
+                await sampler
+        memory = {
+            'peak_rss_mb': peak_total_kb / 1024,
+            'peak_rss_sample_interval_s': args.rss_sample_interval,
+            # Upper bound: each process's own peak, summed whether or not they overlapped
+            'sum_of_process_peak_rss_mb': read_tree_memory_kb(process.pid, 'VmHWM') / 1024,
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return elapsed, memory
+
+
+async def run_url(test):
+    async with httpx.AsyncClient(base_url=test.args.url, timeout=None) as client:
+        elapsed = await test.run(client)
+    return elapsed, {'peak_rss_mb': None}
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the OCR API")
+    parser.add_argument('--mode', choices=['inprocess', 'uvicorn', 'url'], default='inprocess')
+    parser.add_argument('--url', default='http://localhost:8000', help="Target for --mode url")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--duration', type=float, default=30, help="Measured seconds")
+    parser.add_argument('--warmup', type=float, default=2, help="Unmeasured seconds before recording")
+    parser.add_argument('--pdf-ratio', type=float, default=0.5, help="Fraction of uploads that are PDFs")
+    parser.add_argument('--export-ratio', type=float, default=0.2,
+                        help="Fraction of requests sent to /upload-with-export")
+    parser.add_argument('--image-size', type=parse_size, default=(1240, 1754), help="Image size, e.g. 1240x1754")
+    parser.add_argument('--ocr-latency-ms', type=float, default=300, help="Fake OCR mean latency")
+    parser.add_argument('--ocr-jitter-ms', type=float, default=50, help="Fake OCR latency jitter (+/-)")
+    parser.add_argument('--rss-sample-interval', type=float, default=0.1,
+                        help="Seconds between RSS samples of the uvicorn process tree")
+    parser.add_argument('--allow-coalescing', action='store_true',
+                        help="Send identical payloads, letting the server coalesce concurrent OCR calls")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    test = LoadTest(args)
+    with tempfile.TemporaryDirectory(prefix='ocr_load_') as workdir:
+        cwd = os.getcwd()
+        try:
+            if args.mode == 'inprocess':
+                elapsed, memory = asyncio.run(run_inprocess(test, workdir))
+            elif args.mode == 'uvicorn':
+                elapsed, memory = asyncio.run(run_uvicorn(test, workdir))
+            else:
+                elapsed, memory = asyncio.run(run_url(test))
+        finally:
+            os.chdir(cwd)
+
+    report = json.dumps(test.report(elapsed, memory), indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
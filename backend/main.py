@@ -1,15 +1,27 @@
 from fastapi import FastAPI, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import uuid
+import json
+import sqlite3
+import threading
 import os
 import logging
+import math
 from pydantic import BaseModel
 from utils import export_results_to_json
 from document_processor import DocumentProcessor
+from ocr_handler import OCRHandler
+from text_categorizer import CATEGORY_KEYS
+from ocr_store import OCRStore, DOCUMENT_ID_PATTERN
+from document_store import DocumentStore
+from recategorize import iter_recategorized
+from spatial_index import RegionIndexCache
+from memory_budget import MemoryBudget, MemoryBudgetExceeded, MemoryTracker, estimate_decoded_bytes, PDF_RENDER_SCALE
 import fitz  # PyMuPDF for PDF handling
 from PIL import Image
-import io
 import numpy as np
 
 # Setup logging
@@ -23,7 +35,6 @@ try:
     
     if creds_content:
         logger.info("✅ Google Cloud credentials found in env var")
-        import json
         try:
             creds_dict = json.loads(creds_content)
             # Fix the private key - ensure proper newlines
@@ -73,6 +84,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Process-wide budget for decoded image memory (OCR_MEMORY_BUDGET_MB)
+memory_budget = MemoryBudget()
+
+# Raw OCR output per document, so categorization can be re-run without OCR (OCR_STORE_DIR)
+ocr_store = OCRStore()
+
+# Per-document spatial indexes over stored regions, for /documents/{id}/regions
+region_indexes = RegionIndexCache(ocr_store)
+
+# Searchable SQLite store of processed documents (DOCUMENT_DB_PATH)
+document_store = DocumentStore()
+
 def convert_pdf_to_image(pdf_path):
     """
     Convert the first page of a PDF to an image
@@ -80,83 +103,152 @@ def convert_pdf_to_image(pdf_path):
     logger.info(f"Converting PDF to image: {pdf_path}")
     doc = fitz.open(pdf_path)
     page = doc.load_page(0)
-    mat = fitz.Matrix(2.0, 2.0)
+    mat = fitz.Matrix(PDF_RENDER_SCALE, PDF_RENDER_SCALE)
     pix = page.get_pixmap(matrix=mat)
 
-    # Convert to PIL Image
-    img_data = pix.tobytes("ppm")
-    img = Image.open(io.BytesIO(img_data))
+    # Copy the pixmap samples straight into PIL, without an intermediate PPM encoding
+    img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples_mv)
+    pix = None
 
     doc.close()
     logger.info("PDF converted successfully")
     return img
 
+def process_document(temp_filename, file_extension, lang, tracker, filename=None, fields=None):
+    """
+    Run OCR and categorization on a saved upload.
+    Runs in a worker thread; each intermediate image is released as soon as
+    the next stage no longer needs it. Regions are always extracted so the
+    raw OCR output can be stored for later re-categorization.
+    """
+    processor = DocumentProcessor()
+
+    # Handle PDF files by converting to image
+    if file_extension == '.pdf':
+        logger.info("Processing PDF file...")
+        image = convert_pdf_to_image(temp_filename)
+    else:
+        logger.info("Processing image file...")
+        logger.info("Detecting and cropping document...")
+        image = processor.detect_and_crop(temp_filename)
+        logger.info(f"Cropped image size: {getattr(image, 'size', None)}")
+    page_size = image.size
+    tracker.mark('decoded')
+
+    logger.info("Extracting text...")
+    extracted_text, ocr_data, regions = processor.extract_text(image, lang=lang, return_regions=True)
+    image = None
+    tracker.mark('ocr')
+    logger.info(f"Extracted text length: {len(extracted_text) if extracted_text else 0}")
+    logger.info(f"First 100 chars: {extracted_text[:100] if extracted_text else 'N/A'}")
+
+    categorized_result = processor.categorize_text(extracted_text, fields=fields)
+    tracker.mark('categorized')
+
+    document_id = None
+    if not extracted_text.startswith(("OCR error:", "OCR extraction failed")):
+        document_id = ocr_store.save(extracted_text, regions, filename=filename, lang=lang, page_size=page_size)
+        logger.info(f"Stored OCR output as document {document_id}")
+        # A fields= result is stored as incomplete; /recategorize with incomplete_only fills it in later
+        document_store.add(document_id, categorized_result, extracted_text, filename=filename, complete=fields is None)
+
+    return categorized_result, regions, document_id
+
+async def save_upload(file):
+    """Write an upload to a temp file and return its name and extension"""
+    file_extension = os.path.splitext(file.filename)[1].lower() if file.filename else ''
+    temp_filename = f"temp_{uuid.uuid4()}_{file.filename}"
+    logger.info(f"Saving to: {temp_filename}")
+
+    with open(temp_filename, "wb") as buffer:
+        content = await file.read()
+        buffer.write(content)
+    logger.info(f"File saved, size: {len(content)} bytes")
+    return temp_filename, file_extension
+
+async def run_admitted(temp_filename, file_extension, lang, filename=None, fields=None):
+    """Admit the document against the memory budget, then process it off the event loop"""
+    estimate = estimate_decoded_bytes(temp_filename, file_extension)
+    async with memory_budget.reserve(estimate):
+        tracker = MemoryTracker(temp_filename, estimate)
+        tracker.start()
+        try:
+            return await run_in_threadpool(
+                process_document, temp_filename, file_extension, lang, tracker, filename, fields
+            )
+        finally:
+            tracker.stop()
+            tracker.log_summary()
+            memory_budget.record(tracker)
+
+def parse_fields(fields):
+    """Parse a comma-separated fields parameter; None means every category"""
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in CATEGORY_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Valid fields: {', '.join(CATEGORY_KEYS)}")
+    return requested
+
+def memory_rejection_status(error):
+    # 503 lets clients retry a full queue later; 413 means the document is simply too large
+    return 503 if error.retryable else 413
+
 class CategorizedResult(BaseModel):
-    title: list[str]
-    date: list[str]
-    name: list[str]
-    email: list[str]
-    phone: list[str]
-    amount: list[str]
-    address: list[str]
-    tax_id: list[str]
-    invoice_number: list[str]
-    items: list[str]
-    other: list[str]
-    document_type: str
+    """/upload response; with fields= only the requested categories are present"""
+    title: list[str] | None = None
+    date: list[str] | None = None
+    name: list[str] | None = None
+    email: list[str] | None = None
+    phone: list[str] | None = None
+    amount: list[str] | None = None
+    address: list[str] | None = None
+    tax_id: list[str] | None = None
+    invoice_number: list[str] | None = None
+    items: list[str] | None = None
+    other: list[str] | None = None
+    document_type: str | None = None
+    sections: dict | None = None
+    document_id: str | None = None
+    text_regions: list[dict] | None = None
+
+@app.on_event("shutdown")
+def flush_document_store():
+    document_store.close()
 
 @app.get("/health")
 async def health_check():
     logger.info("Health check requested")
     return {"status": "healthy"}
 
+@app.get("/stats")
+async def stats():
+    return {"memory": memory_budget.stats(), "ocr_single_flight": OCRHandler.single_flight.stats()}
+
 @app.post("/upload", response_model=CategorizedResult)
-async def upload_document(file: UploadFile = File(...), lang: str = "eng", return_regions: bool = False):
+async def upload_document(file: UploadFile = File(...), lang: str = "eng", return_regions: bool = False,
+                          fields: str = None):
+    try:
+        requested_fields = parse_fields(fields)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
     temp_filename = None
     try:
         logger.info(f"=== UPLOAD REQUEST START ===")
-        logger.info(f"File: {file.filename}, Lang: {lang}, Regions: {return_regions}")
-        
-        # Determine if file is PDF or image
-        file_extension = os.path.splitext(file.filename)[1].lower() if file.filename else ''
+        logger.info(f"File: {file.filename}, Lang: {lang}, Regions: {return_regions}, Fields: {requested_fields or 'all'}")
+
+        temp_filename, file_extension = await save_upload(file)
         logger.info(f"File extension: {file_extension}")
 
-        # Save uploaded file temporarily
-        temp_filename = f"temp_{uuid.uuid4()}_{file.filename}"
-        logger.info(f"Saving to: {temp_filename}")
-        
-        with open(temp_filename, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        logger.info(f"File saved, size: {len(content)} bytes")
-
-        # Process the document
-        logger.info("Initializing DocumentProcessor...")
-        processor = DocumentProcessor()
-        logger.info("DocumentProcessor initialized")
-
-        # Handle PDF files by converting to image
-        if file_extension == '.pdf':
-            logger.info("Processing PDF file...")
-            image = convert_pdf_to_image(temp_filename)
-            logger.info("Extracting text from PDF...")
-            extracted_text, ocr_data, regions = processor.extract_text(image, lang=lang, return_regions=return_regions)
-            categorized_result = processor.categorize_text(extracted_text)
-        else:
-            logger.info("Processing image file...")
-            logger.info("Detecting and cropping document...")
-            cropped_image = processor.detect_and_crop(temp_filename)
-            logger.info(f"Cropped image type: {type(cropped_image)}")
-            if hasattr(cropped_image, 'shape'):
-                logger.info(f"Cropped image shape: {cropped_image.shape}")
-            logger.info("Extracting text from image...")
-            extracted_text, ocr_data, regions = processor.extract_text(cropped_image, lang=lang, return_regions=return_regions)
-            logger.info(f"Extracted text length: {len(extracted_text) if extracted_text else 0}")
-            logger.info(f"First 100 chars: {extracted_text[:100] if extracted_text else 'N/A'}")
-            categorized_result = processor.categorize_text(extracted_text)
+        categorized_result, regions, document_id = await run_admitted(
+            temp_filename, file_extension, lang, file.filename, requested_fields
+        )
 
         # Add text regions to response if requested
         response_data = dict(categorized_result)
+        response_data['document_id'] = document_id
         if return_regions and regions:
             response_data['text_regions'] = regions
             logger.info(f"Added {len(regions)} text regions to response")
@@ -169,10 +261,14 @@ async def upload_document(file: UploadFile = File(...), lang: str = "eng", retur
         logger.error(f"=== UPLOAD REQUEST ERROR ===")
         logger.error(f"Error type: {type(e).__name__}")
         logger.error(f"Error message: {str(e)}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        if isinstance(e, MemoryBudgetExceeded):
+            status_code = memory_rejection_status(e)
+        else:
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            status_code = 500
         return JSONResponse(
-            status_code=500,
+            status_code=status_code,
             content={
                 "title": [],
                 "date": [],
@@ -196,37 +292,144 @@ async def upload_document(file: UploadFile = File(...), lang: str = "eng", retur
 
 @app.post("/upload-with-export")
 async def upload_document_with_export(file: UploadFile = File(...), lang: str = "eng"):
+    temp_filename = None
     try:
-        # Determine if file is PDF or image
-        file_extension = os.path.splitext(file.filename)[1].lower() if file.filename else ''
-
-        # Save uploaded file temporarily
-        temp_filename = f"temp_{uuid.uuid4()}_{file.filename}"
-        with open(temp_filename, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-
-        # Process the document
-        processor = DocumentProcessor()
-
-        # Handle PDF files by converting to image
-        if file_extension == '.pdf':
-            image = convert_pdf_to_image(temp_filename)
-            extracted_text, ocr_data, regions = processor.extract_text(image, lang=lang, return_regions=True)
-            categorized_result = processor.categorize_text(extracted_text)
-        else:
-            cropped_image = processor.detect_and_crop(temp_filename)
-            extracted_text, ocr_data, regions = processor.extract_text(cropped_image, lang=lang, return_regions=True)
-            categorized_result = processor.categorize_text(extracted_text)
+        temp_filename, file_extension = await save_upload(file)
+
+        categorized_result, regions, document_id = await run_admitted(
+            temp_filename, file_extension, lang, file.filename
+        )
 
         # Export results to JSON
         export_filename = export_results_to_json(categorized_result)
 
-        return {"result": categorized_result, "export_file": export_filename}
+        return {"result": categorized_result, "export_file": export_filename, "document_id": document_id}
+    except MemoryBudgetExceeded as e:
+        logger.error(f"Upload with export rejected: {str(e)}")
+        return JSONResponse(
+            status_code=memory_rejection_status(e),
+            content={"error": str(e), "result": None, "export_file": None},
+        )
     except Exception as e:
         logger.error(f"Upload with export error: {str(e)}")
         return {"error": str(e), "result": None, "export_file": None}
     finally:
         # Clean up temporary file
-        if os.path.exists(temp_filename):
+        if temp_filename and os.path.exists(temp_filename):
             os.remove(temp_filename)
+
+# Concurrent /recategorize runs each start a process pool, so only a few may run at once
+recategorize_slots = threading.BoundedSemaphore(int(os.environ.get('OCR_RECATEGORIZE_MAX_RUNS', 1)))
+
+class RecategorizeRequest(BaseModel):
+    document_ids: list[str] | None = None
+    workers: int | None = None
+    incomplete_only: bool = False
+
+@app.post("/recategorize")
+async def recategorize_documents(request: RecategorizeRequest):
+    """
+    Re-run categorization over stored OCR text, streaming one JSON object per
+    line as each document finishes. Omit document_ids to process every document,
+    or set incomplete_only to fill in documents stored from a fields= upload.
+    Requests beyond OCR_RECATEGORIZE_MAX_RUNS concurrent runs get a 429.
+    New results replace the searchable copies in the document store.
+    """
+    max_workers = os.cpu_count() or 1
+    if request.workers is not None and not 1 <= request.workers <= max_workers:
+        return JSONResponse(status_code=400, content={"error": f"workers must be between 1 and {max_workers}"})
+    if request.document_ids is not None:
+        if request.incomplete_only:
+            return JSONResponse(status_code=400, content={"error": "Pass either document_ids or incomplete_only"})
+        invalid = [i for i in request.document_ids if not DOCUMENT_ID_PATTERN.match(i)]
+        if invalid:
+            return JSONResponse(status_code=400, content={"error": f"Invalid document ids: {invalid[:10]}"})
+    document_ids = request.document_ids
+    if request.incomplete_only:
+        document_ids = await run_in_threadpool(document_store.incomplete_ids)
+
+    # Never wait for a slot: a waiting stream would park a threadpool thread that uploads need
+    if not recategorize_slots.acquire(blocking=False):
+        return JSONResponse(status_code=429, content={"error": "A re-categorization run is already in progress"},
+                            headers={"Retry-After": "60"})
+
+    release_once = threading.Lock()
+
+    def release_slot():
+        # Called from both the stream and the background task; only the first call frees the slot
+        if release_once.acquire(blocking=False):
+            recategorize_slots.release()
+
+    logger.info(f"Re-categorizing {len(document_ids) if document_ids is not None else 'all'} documents")
+
+    def stream():
+        try:
+            # spawn: forking a process that is running the event loop and threadpool is unsafe
+            for item in iter_recategorized(ocr_store, document_ids, request.workers, start_method='spawn'):
+                if 'result' in item:
+                    document_store.update(item['document_id'], item['result'])
+                yield json.dumps(item, ensure_ascii=False) + '\n'
+        finally:
+            release_slot()
+
+    # The background task also frees the slot if the client disconnects before the stream starts
+    return StreamingResponse(stream(), media_type="application/x-ndjson", background=BackgroundTask(release_slot))
+
+@app.get("/documents/{document_id}/regions")
+async def query_regions(document_id: str, x: float, y: float, width: float = None, height: float = None,
+                        category: str = None, units: str = "px"):
+    """
+    Return the stored regions that intersect a rectangle, or contain a point
+    when width/height are omitted, optionally limited to one category.
+    Coordinates are pixels, or percentages of the page with units=percent.
+    """
+    if not DOCUMENT_ID_PATTERN.match(document_id):
+        return JSONResponse(status_code=400, content={"error": "Invalid document id"})
+    if units not in ("px", "percent"):
+        return JSONResponse(status_code=400, content={"error": "units must be 'px' or 'percent'"})
+    coordinates = [value for value in (x, y, width, height) if value is not None]
+    if not all(math.isfinite(value) for value in coordinates):
+        return JSONResponse(status_code=400, content={"error": "Coordinates must be finite numbers"})
+    if (width is not None and width < 0) or (height is not None and height < 0):
+        return JSONResponse(status_code=400, content={"error": "width and height must not be negative"})
+
+    index, record = await run_in_threadpool(region_indexes.get, document_id)
+    if index is None:
+        return JSONResponse(status_code=404, content={"error": "Document not found"})
+
+    if units == "percent":
+        if not record.get('page_size'):
+            return JSONResponse(status_code=400, content={"error": "Page size unknown for this document; use px"})
+        page_width, page_height = record['page_size']
+        x, y = x * page_width / 100, y * page_height / 100
+        width = width * page_width / 100 if width is not None else None
+        height = height * page_height / 100 if height is not None else None
+
+    if width is None and height is None:
+        regions = await run_in_threadpool(index.query_point, x, y, category=category)
+    else:
+        regions = await run_in_threadpool(index.query_rect, x, y, width or 0, height or 0, category=category)
+
+    return {"document_id": document_id, "count": len(regions), "regions": regions}
+
+@app.get("/documents/search")
+async def search_documents(q: str = None, document_type: str = None, tax_id: str = None,
+                           invoice_number: str = None, date: str = None, amount: str = None,
+                           limit: int = 20, cursor: int = None):
+    """
+    Search processed documents by full text (FTS5 query syntax in q), document
+    type and exact extracted field values. Results are newest first; pass
+    next_cursor back as cursor for the next page.
+    """
+    fields = {
+        name: value
+        for name, value in [('tax_id', tax_id), ('invoice_number', invoice_number), ('date', date), ('amount', amount)]
+        if value is not None
+    }
+    limit = max(1, min(limit, 100))
+    try:
+        return await run_in_threadpool(
+            document_store.search, q=q, document_type=document_type, fields=fields, limit=limit, cursor=cursor
+        )
+    except sqlite3.OperationalError as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid search query: {e}"})
@@ -0,0 +1,212 @@
+"""
+Memory-budget admission control for decoded images.
+
+Uploads are small on disk but large once decoded, so each request's decoded
+pixel memory is estimated from the image/PDF header before anything is
+decoded. Requests wait until the estimate fits in the process-wide budget,
+and are rejected if it never can or if they wait too long.
+"""
+import asyncio
+import logging
+import os
+import resource
+import threading
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Render scale used by convert_pdf_to_image
+PDF_RENDER_SCALE = 2.0
+
+MB = 1024 * 1024
+
+# Modes PIL can write as PNG; anything else (e.g. CMYK JPEGs) is converted to RGB before OCR
+PNG_WRITABLE_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16')
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a request cannot be admitted within the memory budget"""
+
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def estimate_decoded_bytes(path, file_extension, pipeline_factor=None):
+    """
+    Estimate the peak memory a document needs once decoded, from headers only.
+    The raw pixel size is multiplied by pipeline_factor to cover the copies
+    that coexist while a stage runs (pixels, PIL image, PNG buffer for OCR).
+    """
+    if pipeline_factor is None:
+        pipeline_factor = float(os.environ.get('OCR_MEMORY_PIPELINE_FACTOR', 2.5))
+
+    try:
+        if file_extension == '.pdf':
+            import fitz
+            with fitz.open(path) as doc:
+                rect = doc.load_page(0).rect
+            width = int(rect.width * PDF_RENDER_SCALE)
+            height = int(rect.height * PDF_RENDER_SCALE)
+            mode = 'RGB'
+        else:
+            from PIL import Image
+            # Image.open only parses the header; pixels are decoded on load()
+            with Image.open(path) as img:
+                width, height = img.size
+                mode = img.mode
+        # PIL keeps single-band 8-bit images at 1 byte per pixel, everything else at 4
+        bytes_per_pixel = 1 if mode in ('1', 'L', 'P') else 4
+        raw_bytes = width * height * bytes_per_pixel
+        if mode not in PNG_WRITABLE_MODES:
+            # detect_and_crop converts to RGB; both copies exist during the conversion
+            raw_bytes += width * height * 4
+    except Exception as e:
+        logger.warning(f"Could not read header of {path}, estimating from file size: {e}")
+        raw_bytes = os.path.getsize(path)
+
+    return int(raw_bytes * pipeline_factor)
+
+
+def current_rss_bytes():
+    """Current resident set size, falling back to the peak where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryTracker:
+    """
+    Records process RSS at each pipeline stage of a request.
+    Stages free their intermediates before mark() runs, so between start()
+    and stop() a background thread also samples RSS to catch the peak inside
+    each stage (PNG encode, pixel hash, Vision call).
+    Under concurrency the deltas include other requests' memory, so they are
+    an upper bound on what a single request used.
+    """
+
+    def __init__(self, label, estimate_bytes=0, sample_interval=None):
+        self.label = label
+        self.estimate_bytes = estimate_bytes
+        if sample_interval is None:
+            sample_interval = float(os.environ.get('OCR_MEMORY_SAMPLE_MS', 5)) / 1000
+        self.sample_interval = sample_interval
+        self.start_rss = current_rss_bytes()
+        self.peak_rss = self.start_rss
+        self.stage_peak_rss = self.start_rss
+        self.stages = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        if self.sample_interval > 0:
+            self._sampler = threading.Thread(target=self._sample_loop, name='memory-tracker', daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self._sample()
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.sample_interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_bytes()
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            self.stage_peak_rss = max(self.stage_peak_rss, rss)
+        return rss
+
+    def mark(self, stage):
+        rss = self._sample()
+        with self._lock:
+            self.stages.append((stage, rss - self.start_rss, self.stage_peak_rss - self.start_rss))
+            self.stage_peak_rss = rss
+
+    @property
+    def peak_delta_bytes(self):
+        return self.peak_rss - self.start_rss
+
+    def log_summary(self):
+        stages = ', '.join(f"{stage}={delta / MB:+.1f}MB (peak {peak / MB:+.1f}MB)"
+                           for stage, delta, peak in self.stages)
+        logger.info(
+            f"Memory for {self.label}: peak {self.peak_delta_bytes / MB:+.1f}MB "
+            f"(estimated {self.estimate_bytes / MB:.1f}MB) [{stages}]"
+        )
+
+
+class MemoryBudget:
+    """Process-wide budget of decoded-image bytes shared by all requests"""
+
+    def __init__(self, budget_bytes=None, queue_timeout=None, max_waiting=None):
+        self.budget_bytes = budget_bytes or int(float(os.environ.get('OCR_MEMORY_BUDGET_MB', 256)) * MB)
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.environ.get('OCR_ADMISSION_TIMEOUT', 30))
+        self.max_waiting = max_waiting if max_waiting is not None else int(os.environ.get('OCR_ADMISSION_MAX_QUEUE', 16))
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.peak_request_delta = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, nbytes):
+        if nbytes > self.budget_bytes:
+            self.rejected += 1
+            raise MemoryBudgetExceeded(
+                f"Document needs ~{nbytes / MB:.0f}MB decoded, over the {self.budget_bytes / MB:.0f}MB budget",
+                retryable=False,
+            )
+
+        async with self._condition:
+            if self.in_use + nbytes > self.budget_bytes:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise MemoryBudgetExceeded("Too many documents queued for memory", retryable=True)
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(
+                        self._condition.wait_for(lambda: self.in_use + nbytes <= self.budget_bytes),
+                        timeout=self.queue_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise MemoryBudgetExceeded(
+                        f"Timed out after {self.queue_timeout:.0f}s waiting for memory", retryable=True
+                    )
+                finally:
+                    self.waiting -= 1
+            self.in_use += nbytes
+            self.admitted += 1
+
+    async def release(self, nbytes):
+        async with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes):
+        await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            await self.release(nbytes)
+
+    def record(self, tracker):
+        self.peak_request_delta = max(self.peak_request_delta, tracker.peak_delta_bytes)
+
+    def stats(self):
+        return {
+            'budget_mb': self.budget_bytes / MB,
+            'in_use_mb': self.in_use / MB,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'peak_request_rss_delta_mb': self.peak_request_delta / MB,
+        }
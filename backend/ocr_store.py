@@ -0,0 +1,75 @@
+"""
+Per-document storage of raw OCR output (text plus regions).
+
+Keeping the OCR result lets categorization be re-run after pattern changes
+without paying for OCR again. Each document is one JSON file, sharded into
+sub-directories by the first two characters of its id.
+"""
+import json
+import os
+import re
+import uuid
+from datetime import datetime
+
+DOCUMENT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class OCRStore:
+    def __init__(self, root=None):
+        self.root = root or os.environ.get('OCR_STORE_DIR', 'ocr_store')
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, document_id):
+        if not DOCUMENT_ID_PATTERN.match(document_id):
+            raise ValueError(f"Invalid document id: {document_id}")
+        return os.path.join(self.root, document_id[:2], f"{document_id}.json")
+
+    def save(self, text, regions, filename=None, lang=None, page_size=None):
+        """Persist an OCR result and return its new document id"""
+        document_id = uuid.uuid4().hex
+        record = {
+            'document_id': document_id,
+            'created_at': datetime.now().isoformat(),
+            'filename': filename,
+            'lang': lang,
+            'page_size': list(page_size) if page_size else None,
+            'text': text,
+            'regions': regions,
+        }
+
+        path = self.path_for(document_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a half-written file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        return document_id
+
+    def load(self, document_id):
+        """Return the stored record, or None if the document is unknown"""
+        try:
+            return load_record(self.path_for(document_id))
+        except (ValueError, FileNotFoundError):
+            return None
+
+    def iter_paths(self, document_ids=None):
+        """Yield record paths for the given ids, or for every stored document"""
+        if document_ids is not None:
+            for document_id in document_ids:
+                yield self.path_for(document_id)
+            return
+
+        with os.scandir(self.root) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as entries:
+                    for entry in entries:
+                        if entry.name.endswith('.json'):
+                            yield entry.path
+
+
+def load_record(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,123 @@
+"""
+Re-run TextCategorizer over stored OCR output without re-running OCR.
+
+Documents are categorized in a pool of worker processes and results are
+streamed out as they finish, one JSON object per line.
+
+Usage:
+    python recategorize.py --store ocr_store --workers 8 --output results.ndjson
+    python recategorize.py --ids-file ids.txt
+    python recategorize.py --update-db documents.db
+    python recategorize.py --update-db documents.db --incomplete-only
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from document_store import DocumentStore
+from ocr_store import OCRStore, DOCUMENT_ID_PATTERN, load_record
+from text_categorizer import TextCategorizer
+
+# One categorizer per worker process, built by _init_worker
+_categorizer = None
+
+
+def _init_worker():
+    global _categorizer
+    _categorizer = TextCategorizer()
+
+
+def _recategorize_path(path):
+    document_id = os.path.splitext(os.path.basename(path))[0]
+    try:
+        record = load_record(path)
+    except FileNotFoundError:
+        return {'document_id': document_id, 'error': 'Document not found'}
+    except Exception as e:
+        return {'document_id': document_id, 'error': str(e)}
+    return {'document_id': document_id, 'result': _categorizer.categorize_text(record['text'])}
+
+
+def iter_recategorized(store, document_ids=None, workers=None, chunksize=64, start_method=None):
+    """
+    Yield {'document_id', 'result'} (or 'error') for each stored document.
+    Results arrive in completion order, not store order. Malformed ids are
+    reported as errors up front and never reach the workers.
+    """
+    if document_ids is not None:
+        valid_ids = []
+        for document_id in document_ids:
+            if DOCUMENT_ID_PATTERN.match(document_id):
+                valid_ids.append(document_id)
+            else:
+                yield {'document_id': document_id, 'error': 'Invalid document id'}
+        document_ids = valid_ids
+    paths = store.iter_paths(document_ids)
+
+    if workers == 1:
+        _init_worker()
+        for path in paths:
+            yield _recategorize_path(path)
+        return
+
+    context = multiprocessing.get_context(start_method)
+    with context.Pool(workers, initializer=_init_worker) as pool:
+        yield from pool.imap_unordered(_recategorize_path, paths, chunksize)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-categorize stored OCR text")
+    parser.add_argument('--store', help="OCR store directory (default: OCR_STORE_DIR or ./ocr_store)")
+    parser.add_argument('--ids-file', help="File with one document id per line (default: all documents)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--chunksize', type=int, default=64, help="Documents per task sent to a worker")
+    parser.add_argument('--output', help="Write NDJSON here instead of stdout")
+    parser.add_argument('--update-db', metavar='PATH',
+                        help="Also replace the stored results in this document database")
+    parser.add_argument('--incomplete-only', action='store_true',
+                        help="Only documents the --update-db database holds partial (fields=) results for")
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.chunksize < 1:
+        parser.error("--chunksize must be at least 1")
+    if args.incomplete_only and not args.update_db:
+        parser.error("--incomplete-only requires --update-db")
+    if args.incomplete_only and args.ids_file:
+        parser.error("--incomplete-only cannot be combined with --ids-file")
+
+    store = OCRStore(args.store)
+    document_store = DocumentStore(args.update_db) if args.update_db else None
+    document_ids = None
+    if args.ids_file:
+        with open(args.ids_file, encoding='utf-8') as f:
+            document_ids = [line.strip() for line in f if line.strip()]
+    elif args.incomplete_only:
+        document_ids = document_store.incomplete_ids()
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    start_time = time.time()
+    count = errors = 0
+    try:
+        for item in iter_recategorized(store, document_ids, args.workers, args.chunksize):
+            out.write(json.dumps(item, ensure_ascii=False) + '\n')
+            if document_store is not None and 'result' in item:
+                document_store.update(item['document_id'], item['result'])
+            count += 1
+            errors += 'error' in item
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if document_store is not None:
+            document_store.close()
+
+    elapsed = time.time() - start_time
+    print(f"Re-categorized {count} documents ({errors} errors) in {elapsed:.1f}s "
+          f"({count / elapsed if elapsed > 0 else 0:.0f} docs/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
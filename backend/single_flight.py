@@ -0,0 +1,64 @@
+"""
+Single-flight coalescing of concurrent identical calls.
+
+The first caller for a key runs the function; callers that arrive with the
+same key while it is running wait for it and share its result or error.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        Run fn() once per key at a time. Returns (result, shared), where shared
+        is True for callers that waited on another caller's call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+        }
@@ -0,0 +1,191 @@
+"""
+Uniform-grid spatial index over OCR text regions.
+
+Lets the API answer "which regions intersect this rectangle / contain this
+point" without shipping every region to the client.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from text_categorizer import TextCategorizer
+
+# Pattern categories only, specific fields first when a word appears in several.
+# Line-level categories (title, items, other) would tag common words everywhere.
+REGION_CATEGORY_PRIORITY = [
+    'tax_id', 'invoice_number', 'amount', 'date', 'email', 'phone', 'name', 'address',
+]
+
+# Values in these categories always contain a digit, but their patterns also
+# match label words such as "Invoice No" or "VAT", which must stay untagged
+DIGIT_CATEGORIES = {'tax_id', 'invoice_number', 'amount', 'phone'}
+
+
+def group_lines(regions):
+    """Group word regions into lines (top to bottom) sorted left to right"""
+    if not regions:
+        return []
+
+    def center_y(region):
+        return region['bbox']['y'] + region['bbox']['height'] / 2
+
+    lines = []
+    for region in sorted(regions, key=center_y):
+        if lines:
+            line = lines[-1]
+            line_center = sum(center_y(r) for r in line) / len(line)
+            line_height = max(r['bbox']['height'] for r in line)
+            if abs(center_y(region) - line_center) <= max(line_height, region['bbox']['height']) / 2:
+                line.append(region)
+                continue
+        lines.append([region])
+
+    return [sorted(line, key=lambda r: r['bbox']['x']) for line in lines]
+
+
+def _value_spans(match):
+    """Spans of the captured groups, or of the whole match for patterns without groups"""
+    groups = [match.span(i) for i in range(1, match.re.groups + 1) if match.start(i) != -1]
+    return [span for span in groups or [match.span()] if span[0] < span[1]]
+
+
+def tag_regions(regions, categorizer):
+    """
+    Return copies of the word regions tagged with the pattern category that
+    matched them, or None. Each category's patterns run over the words'
+    visual lines and every match is mapped back to the words it overlaps, so
+    a partial match such as "$1,250" still tags the word "$1,250.00" and a
+    repeated word elsewhere on the page is not tagged with it.
+    """
+    tagged = [dict(region, category=None) for region in regions]
+    for line in group_lines(tagged):
+        spans = []
+        offset = 0
+        for region in line:
+            spans.append((offset, offset + len(region['text'])))
+            offset += len(region['text']) + 1
+        text = ' '.join(region['text'] for region in line)
+        if text.isupper() and not any(c.isdigit() for c in text):
+            # All-caps headings such as "TAX INVOICE" are not field values
+            continue
+
+        for category in REGION_CATEGORY_PRIORITY:
+            for pattern in categorizer.patterns[category]:
+                try:
+                    matches = list(re.finditer(pattern, text, re.IGNORECASE))
+                except re.error:
+                    continue
+                for match in matches:
+                    for start, end in _value_spans(match):
+                        for region, (word_start, word_end) in zip(line, spans):
+                            if region['category'] is not None or word_end <= start or end <= word_start:
+                                continue
+                            if category in DIGIT_CATEGORIES and not any(c.isdigit() for c in region['text']):
+                                continue
+                            region['category'] = category
+    return tagged
+
+
+class GridIndex:
+    def __init__(self, regions, cell_size=None):
+        self.regions = regions
+        self.cell_size = cell_size or self._default_cell_size(regions)
+        self.cells = {}
+        # Occupied cell extent; queries are clamped to it so huge rectangles stay cheap
+        self.extent = None
+        for i, region in enumerate(regions):
+            bbox = region['bbox']
+            for cell in self._cells_for(bbox['x'], bbox['y'], bbox['width'], bbox['height']):
+                self.cells.setdefault(cell, []).append(i)
+        if self.cells:
+            xs = [cx for cx, _ in self.cells]
+            ys = [cy for _, cy in self.cells]
+            self.extent = (min(xs), min(ys), max(xs), max(ys))
+
+    @staticmethod
+    def _default_cell_size(regions):
+        # About four median-sized words per cell keeps both buckets and candidate lists small
+        if not regions:
+            return 64
+        widths = sorted(region['bbox']['width'] for region in regions)
+        return max(int(widths[len(widths) // 2] * 4), 16)
+
+    def _cells_for(self, x, y, width, height):
+        size = self.cell_size
+        for cx in range(int(x // size), int((x + width) // size) + 1):
+            for cy in range(int(y // size), int((y + height) // size) + 1):
+                yield (cx, cy)
+
+    def _candidates(self, x, y, width, height):
+        if self.extent is None:
+            return
+        size = self.cell_size
+        min_cx, min_cy, max_cx, max_cy = self.extent
+        x0, x1 = max(x // size, min_cx), min((x + width) // size, max_cx)
+        y0, y1 = max(y // size, min_cy), min((y + height) // size, max_cy)
+        if x0 > x1 or y0 > y1:
+            return
+
+        # Walking more cells than there are regions is slower than checking every region
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.regions):
+            yield from range(len(self.regions))
+            return
+
+        seen = set()
+        for cell in self._cells_for(x0 * size, y0 * size, (x1 - x0) * size, (y1 - y0) * size):
+            for i in self.cells.get(cell, ()):
+                if i not in seen:
+                    seen.add(i)
+                    yield i
+
+    def query_rect(self, x, y, width, height, category=None):
+        """Regions whose boxes intersect the rectangle, in OCR order"""
+        if width < 0 or height < 0:
+            raise ValueError("width and height must not be negative")
+        hits = []
+        for i in self._candidates(x, y, width, height):
+            region = self.regions[i]
+            bbox = region['bbox']
+            if category is not None and region.get('category') != category:
+                continue
+            if (bbox['x'] <= x + width and x <= bbox['x'] + bbox['width']
+                    and bbox['y'] <= y + height and y <= bbox['y'] + bbox['height']):
+                hits.append(i)
+        return [self.regions[i] for i in sorted(hits)]
+
+    def query_point(self, x, y, category=None):
+        """Regions whose boxes contain the point, in OCR order"""
+        return self.query_rect(x, y, 0, 0, category=category)
+
+
+class RegionIndexCache:
+    """
+    LRU of per-document grid indexes, built from the OCR store on first use.
+    Regions are tagged when the index is built, so tags follow the current
+    patterns rather than whatever the upload requested.
+    """
+
+    def __init__(self, store, max_documents=256):
+        self.store = store
+        self.max_documents = max_documents
+        self.categorizer = TextCategorizer()
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, document_id):
+        """Return (index, record) for a document, or (None, None) if it is unknown"""
+        with self._lock:
+            if document_id in self._indexes:
+                self._indexes.move_to_end(document_id)
+                return self._indexes[document_id]
+
+        record = self.store.load(document_id)
+        if record is None:
+            return None, None
+        entry = (GridIndex(tag_regions(record.get('regions') or [], self.categorizer)), record)
+
+        with self._lock:
+            self._indexes[document_id] = entry
+            while len(self._indexes) > self.max_documents:
+                self._indexes.popitem(last=False)
+        return entry
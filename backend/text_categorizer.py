@@ -1,6 +1,14 @@
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+# Keys of a categorization result, in response order
+CATEGORY_KEYS = [
+    'title', 'date', 'name', 'email', 'phone', 'amount', 'address', 'tax_id',
+    'invoice_number', 'items', 'other', 'document_type', 'sections',
+]
+
 class TextCategorizer:
     def __init__(self):
         self.patterns = {
@@ -156,24 +164,31 @@ class TextCategorizer:
         Categorize text based on detected sections/headings
         """
         sections = self.detect_section_headers(lines)
-        categorized_sections = {}
         
         if len(sections) >= 2:
-            # Group content between section headers
-            for i in range(len(sections)):
-                start_idx = sections[i][0]
-                end_idx = sections[i + 1][0] if i + 1 < len(sections) else len(lines)
-                
-                section_title = sections[i][1]
-                section_content = lines[start_idx + 1:end_idx]
-                
-                # Categorize content within this section
-                section_data = {
-                    'title': section_title,
-                    'content': [line.strip() for line in section_content if line.strip()],
-                    'category': self._infer_section_category(section_title)
-                }
-                categorized_sections[section_title] = section_data
+            return self._group_sections(lines, sections)
+        return {}
+
+    def _group_sections(self, lines, sections):
+        """
+        Group content between section headers; the last section runs to the
+        end of lines
+        """
+        categorized_sections = {}
+        for i in range(len(sections)):
+            start_idx = sections[i][0]
+            end_idx = sections[i + 1][0] if i + 1 < len(sections) else len(lines)
+            
+            section_title = sections[i][1]
+            section_content = lines[start_idx + 1:end_idx]
+            
+            # Categorize content within this section
+            section_data = {
+                'title': section_title,
+                'content': [line.strip() for line in section_content if line.strip()],
+                'category': self._infer_section_category(section_title)
+            }
+            categorized_sections[section_title] = section_data
         
         return categorized_sections
 
@@ -200,38 +215,138 @@ class TextCategorizer:
         
         return 'general'
 
-    def categorize_text(self, text):
+    def categorize_text(self, text, fields=None):
+        """
+        Categorize OCR text. When fields is given, only those keys are
+        returned and work that cannot affect them (unrequested pattern groups,
+        title, doc-type scoring, section detection) is skipped.
+        """
         lines = text.split('\n')
-        categories = {
-            'title': [],
-            'date': [],
-            'name': [],
-            'email': [],
-            'phone': [],
-            'amount': [],
-            'address': [],
-            'tax_id': [],
-            'invoice_number': [],
-            'items': [],
-            'other': [],
-            'document_type': 'unknown',
-            'sections': {}
-        }
+        categories = self._new_categories(self.resolve_fields(fields))
+        self._categorize_document(text, lines, categories)
+
+        # Process each line for categorization
+        self._categorize_lines(lines, categories)
+
+        # Detect sections for structured documents
+        if 'sections' in categories:
+            categories['sections'] = self.categorize_by_sections(text, lines)
+
+        self._dedupe(categories)
+        return categories
+
+    def categorize_text_parallel(self, text, workers=None, fields=None, executor=None, min_chunk_lines=200):
+        """
+        Same result as categorize_text, computed by splitting the lines at
+        section headers and categorizing the chunks in worker processes.
+        Chunks are merged in document order before de-duplication, so
+        first-seen order and the section mapping match the serial pass.
+        Pass a ProcessPoolExecutor to reuse workers across calls.
+        """
+        lines = text.split('\n')
+        wanted = self.resolve_fields(fields)
+        workers = workers or os.cpu_count() or 1
+        headers = self.detect_section_headers(lines)
+        chunks = self._chunk_at_headers(lines, headers, workers, min_chunk_lines)
+
+        if len(chunks) < 2:
+            return self.categorize_text(text, fields=fields)
+
+        categories = self._new_categories(wanted)
+        self._categorize_document(text, lines, categories)
+
+        jobs = [(lines[start:end], [(i - start, title) for i, title in headers if start <= i < end], wanted)
+                for start, end in chunks]
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=init_chunk_worker)
+        try:
+            chunk_results = list(executor.map(_categorize_chunk, jobs))
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+        sections = {}
+        for chunk_categories, chunk_sections in chunk_results:
+            for category, items in chunk_categories.items():
+                categories[category].extend(items)
+            sections.update(chunk_sections)
+
+        # categorize_by_sections only reports sections when there are at least two
+        if 'sections' in categories:
+            categories['sections'] = sections if len(headers) >= 2 else {}
+
+        self._dedupe(categories)
+        return categories
+
+    def _chunk_at_headers(self, lines, headers, workers, min_chunk_lines):
+        """Split line indices into (start, end) ranges that begin at section headers"""
+        target = max(len(lines) // (workers * 4), min_chunk_lines)
+        chunks = []
+        start = 0
+        for i, _ in headers:
+            if i - start >= target:
+                chunks.append((start, i))
+                start = i
+        chunks.append((start, len(lines)))
+        return chunks
 
+    def _new_categories(self, wanted):
+        return {key: ([] if key not in ('document_type', 'sections') else None) for key in wanted}
+
+    def _categorize_document(self, text, lines, categories):
+        """Whole-document fields: document type and title"""
         # Detect document type
-        categories['document_type'] = self.detect_document_type(text)
+        if 'document_type' in categories:
+            categories['document_type'] = self.detect_document_type(text)
 
         # Extract title (usually first significant line)
-        for line in lines[:5]:
-            line = line.strip()
-            if len(line) > 3:
-                is_not_title = any(keyword in line.lower() for keyword in ['total', 'amount', 'date', 'email', 'page'])
-                is_thai_title = any(keyword in line for keyword in self.thai_keywords['title_indicators'])
-                if not is_not_title and (is_thai_title or len(line) > 5):
-                    categories['title'].append(line)
-                    break
+        if 'title' in categories:
+            for line in lines[:5]:
+                line = line.strip()
+                if len(line) > 3:
+                    is_not_title = any(keyword in line.lower() for keyword in ['total', 'amount', 'date', 'email', 'page'])
+                    is_thai_title = any(keyword in line for keyword in self.thai_keywords['title_indicators'])
+                    if not is_not_title and (is_thai_title or len(line) > 5):
+                        categories['title'].append(line)
+                        break
 
-        # Process each line for categorization
+    def _categorize_lines(self, lines, categories):
+        if 'items' in categories or 'other' in categories:
+            self._categorize_lines_full(lines, categories)
+        elif any(category in categories for category in self.patterns):
+            self._categorize_lines_selective(lines, categories)
+
+    def _dedupe(self, categories):
+        """Remove duplicates while preserving order"""
+        for category, items in categories.items():
+            if not isinstance(items, list):
+                continue
+            seen = set()
+            categories[category] = [item for item in items if not (item in seen or seen.add(item))]
+
+    def resolve_fields(self, fields=None):
+        """Return the requested category keys in result order, rejecting unknown ones"""
+        if fields is None:
+            return list(CATEGORY_KEYS)
+        unknown = [field for field in fields if field not in CATEGORY_KEYS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return [key for key in CATEGORY_KEYS if key in fields]
+
+    def _match_line(self, line, category):
+        """Return the matches of the first pattern in a category that hits the line"""
+        for pattern in self.patterns[category]:
+            try:
+                matches = re.findall(pattern, line, re.IGNORECASE)
+                if matches:
+                    return matches
+            except:
+                continue
+        return None
+
+    def _categorize_lines_full(self, lines, categories):
+        """Assign every line to the first matching pattern group, else to items/other"""
         for line in lines:
             line = line.strip()
             if not line or len(line) < 3:
@@ -240,20 +355,12 @@ class TextCategorizer:
             categorized = False
 
             # Check against patterns
-            for category, patterns in self.patterns.items():
-                if category in ['title', 'items', 'other', 'document_type', 'sections']:
-                    continue
-                    
-                for pattern in patterns:
-                    try:
-                        matches = re.findall(pattern, line, re.IGNORECASE)
-                        if matches:
-                            categories[category].extend([str(m) for m in matches])
-                            categorized = True
-                            break
-                    except:
-                        continue
-                if categorized:
+            for category in self.patterns:
+                matches = self._match_line(line, category)
+                if matches:
+                    if category in categories:
+                        categories[category].extend([str(m) for m in matches])
+                    categorized = True
                     break
 
             # If not categorized by patterns, classify as item or other
@@ -261,27 +368,54 @@ class TextCategorizer:
                 # Check for English and Thai item keywords
                 is_item = any(word in line.lower() for word in ['item', 'product', 'service', 'qty', 'quantity', 'description'])
                 is_thai_item = any(word in line for word in self.thai_keywords['items'])
-                is_section_header = any(word in line for word in self.thai_keywords['section_headers'])
-                
+
                 if is_item or is_thai_item:
-                    categories['items'].append(line)
-                elif is_section_header or (len(line) > 5 and line.isupper()):
-                    # Potential section header
-                    categories['other'].append(line)
-                else:
+                    if 'items' in categories:
+                        categories['items'].append(line)
+                elif 'other' in categories:
                     categories['other'].append(line)
 
-        # Detect sections for structured documents
-        categories['sections'] = self.categorize_by_sections(text, lines)
+    def _categorize_lines_selective(self, lines, categories):
+        """
+        Pattern-only pass for a subset of pattern groups. Requested groups are
+        tried first; unrequested groups that come earlier in pattern order are
+        only checked when a requested group matches, since they would have
+        claimed the line first in the full pass.
+        """
+        order = list(self.patterns)
+        requested = [category for category in order if category in categories]
+        earlier_unrequested = {
+            category: [c for c in order[:order.index(category)] if c not in categories]
+            for category in requested
+        }
 
-        # Remove duplicates while preserving order
-        for category in categories:
-            if category == 'sections':
+        for line in lines:
+            line = line.strip()
+            if not line or len(line) < 3:
                 continue
-            unique_items = []
-            for item in categories[category]:
-                if item not in unique_items:
-                    unique_items.append(item)
-            categories[category] = unique_items
 
-        return categories
+            for category in requested:
+                matches = self._match_line(line, category)
+                if matches:
+                    if not any(self._match_line(line, c) for c in earlier_unrequested[category]):
+                        categories[category].extend([str(m) for m in matches])
+                    break
+
+
+# One categorizer per worker process, built by init_chunk_worker
+_chunk_categorizer = None
+
+
+def init_chunk_worker():
+    global _chunk_categorizer
+    _chunk_categorizer = TextCategorizer()
+
+
+def _categorize_chunk(job):
+    """Categorize one chunk of lines; returns its raw (undeduplicated) lists and sections"""
+    lines, headers, wanted = job
+    categorizer = _chunk_categorizer or TextCategorizer()
+    categories = {key: [] for key in wanted if key not in ('document_type', 'sections', 'title')}
+    categorizer._categorize_lines(lines, categories)
+    sections = categorizer._group_sections(lines, headers) if 'sections' in wanted else {}
+    return categories, sections
@@ -0,0 +1,73 @@
+"""
+Benchmark field-selective categorization against the full pass.
+
+Usage:
+    python benchmarks/bench_fields.py [--lines 2000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from text_categorizer import TextCategorizer
+
+SAMPLE_LINES = [
+    "TAX INVOICE",
+    "Invoice No: INV-2024-0042",
+    "Date: 15/05/2024",
+    "Customer: John Doe",
+    "john.doe@example.com",
+    "081-234-5678",
+    "Item Description Qty Price",
+    "Widget A 2 x 150.00",
+    "Total Amount: $1,250.00",
+    "Tax ID 0105551234567",
+    "123 Main Street",
+    "1. PAYMENT TERMS",
+    "Payment is due within thirty days of the invoice date",
+    "ที่อยู่: 99 ถนน สุขุมวิท",
+    "รวม 1,234.56 บาท",
+]
+
+FIELD_SETS = [
+    None,
+    ['amount', 'invoice_number'],
+    ['email'],
+    ['date', 'amount'],
+    ['document_type'],
+]
+
+
+def make_text(n_lines, seed=0):
+    rng = random.Random(seed)
+    return '\n'.join(rng.choice(SAMPLE_LINES) for _ in range(n_lines))
+
+
+def bench(categorizer, text, fields, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        categorizer.categorize_text(text, fields=fields)
+    return (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark field-selective categorization")
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    categorizer = TextCategorizer()
+    text = make_text(args.lines)
+    full = bench(categorizer, text, None, args.repeat)
+
+    print(f"{args.lines} lines, {args.repeat} runs, CPU time per call")
+    for fields in FIELD_SETS:
+        cpu = full if fields is None else bench(categorizer, text, fields, args.repeat)
+        label = 'all fields' if fields is None else ','.join(fields)
+        print(f"  {label:<24} {cpu * 1000:8.2f} ms  ({(1 - cpu / full) * 100:5.1f}% saved)")
+
+
+if __name__ == "__main__":
+    main()
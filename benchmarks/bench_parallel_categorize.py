@@ -0,0 +1,73 @@
+"""
+Scaling benchmark for section-parallel categorization.
+
+Builds a long multi-section contract, checks that the parallel result is
+identical to the serial one, and times both for each worker count.
+
+Usage:
+    python benchmarks/bench_parallel_categorize.py [--sections 400] [--workers 1,2,4,8,16]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from text_categorizer import TextCategorizer, init_chunk_worker
+
+SECTION_BODY = [
+    "The Supplier shall deliver the goods described in Schedule A.",
+    "Payment of $12,500.00 is due within 30 days of 15/05/2024.",
+    "Contact: legal@example.com or 02-123-4567",
+    "Invoice No: INV-2024-0042",
+    "Item Description Qty Price",
+    "123 Main Street",
+    "Either party may terminate this agreement with written notice.",
+]
+
+
+def make_contract(n_sections, lines_per_section, seed=0):
+    rng = random.Random(seed)
+    lines = ["SERVICE AGREEMENT"]
+    for i in range(1, n_sections + 1):
+        lines.append(f"Article {i} Terms")
+        lines.extend(rng.choice(SECTION_BODY) for _ in range(lines_per_section))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel categorization")
+    parser.add_argument('--sections', type=int, default=400)
+    parser.add_argument('--lines-per-section', type=int, default=100)
+    parser.add_argument('--workers', default='1,2,4,8,16')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    categorizer = TextCategorizer()
+    text = make_contract(args.sections, args.lines_per_section)
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        serial = categorizer.categorize_text(text)
+    serial_time = (time.perf_counter() - start) / args.repeat
+
+    print(f"{text.count(chr(10)) + 1} lines, {args.sections} sections, {os.cpu_count()} CPUs")
+    if (os.cpu_count() or 1) < 2:
+        print("  warning: single CPU, worker timings show overhead only, not scaling")
+    print(f"  serial      {serial_time * 1000:9.1f} ms")
+    for workers in [int(w) for w in args.workers.split(',')]:
+        # Pool start-up is excluded: the server keeps its pool alive between requests
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_chunk_worker) as executor:
+            categorizer.categorize_text_parallel(text, workers=workers, executor=executor)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                result = categorizer.categorize_text_parallel(text, workers=workers, executor=executor)
+            elapsed = (time.perf_counter() - start) / args.repeat
+        assert result == serial, f"parallel result with {workers} workers differs from serial"
+        print(f"  {workers:2d} workers  {elapsed * 1000:9.1f} ms  ({serial_time / elapsed:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
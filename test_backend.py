@@ -4,7 +4,10 @@ Note: This is a basic test that checks if the modules can be imported
 and basic functions work. For full testing, you would need sample images.
 """
 import sys
+import json
 import os
+import time
+import uuid
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
 def test_imports():
@@ -45,6 +48,418 @@ def test_basic_functions():
         print(f"[ERROR] Function test error: {e}")
         return False
 
+def test_tiling():
+    """Test tile ownership at seams, duplicate removal and reading order for tiled OCR"""
+    try:
+        from ocr_handler import OCRHandler
+        handler = OCRHandler(tile_threshold=100, tile_size=100, tile_overlap=20)
+
+        # Ownership boxes cover the page exactly once and stay inside their tiles
+        tiles = handler._tile_boxes(250, 50)
+        assert [tile['box'] for tile in tiles] == [(0, 0, 100, 50), (80, 0, 180, 50), (160, 0, 250, 50)]
+        owned = [(tile['own'][0], tile['own'][2]) for tile in tiles]
+        assert owned == [(0, 90), (90, 170), (170, 250)]
+        for tile in tiles:
+            assert tile['box'][0] <= tile['own'][0] and tile['own'][2] <= tile['box'][2]
+
+        def region(text, x, y, width=30, height=10):
+            return {'text': text, 'bbox': {'x': x, 'y': y, 'width': width, 'height': height}}
+
+        # The same word seen by two tiles is kept once; the same word elsewhere is kept
+        regions = handler._dedupe_regions([region('total', 85, 5), region('total', 87, 6), region('total', 200, 5)])
+        assert [r['bbox']['x'] for r in regions] == [85, 200]
+
+        lines = handler._group_reading_order([region('b', 50, 2), region('c', 0, 30), region('a', 0, 0)])
+        assert [[r['text'] for r in line] for line in lines] == [['a', 'b'], ['c']]
+
+        try:
+            OCRHandler(tile_size=100, tile_overlap=100)
+            raise AssertionError("overlap >= tile size was accepted")
+        except ValueError:
+            pass
+
+        print("[OK] Tiled OCR stitching works")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Tiling test error: {e}")
+        return False
+
+def test_memory_admission():
+    """Test memory estimates and admission: queueing, queue overflow, timeouts and oversized documents"""
+    try:
+        import asyncio
+        import tempfile
+        from memory_budget import MB, MemoryBudget, MemoryBudgetExceeded, MemoryTracker, estimate_decoded_bytes
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # Unreadable headers fall back to the file size
+            path = os.path.join(tmp, 'broken.png')
+            with open(path, 'wb') as f:
+                f.write(b'not an image' * 10)
+            assert estimate_decoded_bytes(path, '.png', pipeline_factor=2) == 240
+
+            try:
+                from PIL import Image
+            except ImportError:
+                Image = None
+            if Image is not None:
+                # CMYK is converted to RGB, so that copy is counted too
+                path = os.path.join(tmp, 'scan.jpg')
+                Image.new('CMYK', (100, 50)).save(path)
+                assert estimate_decoded_bytes(path, '.jpg', pipeline_factor=1) == 100 * 50 * 8
+
+        async def scenario():
+            budget = MemoryBudget(budget_bytes=100, queue_timeout=0.2, max_waiting=1)
+            events = []
+
+            async def job(name, nbytes, hold):
+                try:
+                    async with budget.reserve(nbytes):
+                        events.append(f'start {name}')
+                        await asyncio.sleep(hold)
+                except MemoryBudgetExceeded as e:
+                    events.append(f'reject {name} retryable={e.retryable}')
+
+            # a holds the budget, b queues behind it, c overflows the queue, d can never fit
+            await asyncio.gather(job('a', 80, 0.05), job('b', 50, 0), job('c', 50, 0), job('d', 200, 0))
+            assert events[0] == 'start a' and events[-1] == 'start b', events
+            assert sorted(events[1:-1]) == ['reject c retryable=True', 'reject d retryable=False'], events
+
+            # e waits longer than the queue timeout
+            events.clear()
+            await asyncio.gather(job('f', 80, 0.5), job('e', 50, 0))
+            assert events == ['start f', 'reject e retryable=True'], events
+
+            stats = budget.stats()
+            assert stats['admitted'] == 3 and stats['rejected'] == 3 and stats['in_use_mb'] == 0
+
+        asyncio.run(scenario())
+
+        # A stage that frees its buffer before mark() still shows up in the sampled peak
+        tracker = MemoryTracker('test', sample_interval=0.005)
+        tracker.start()
+        buffer = b'x' * (64 * MB)
+        time.sleep(0.1)
+        del buffer
+        tracker.mark('ocr')
+        tracker.stop()
+        stage, delta, peak = tracker.stages[0]
+        assert peak >= 48 * MB and tracker.peak_delta_bytes >= 48 * MB, tracker.stages
+        assert delta < peak - 32 * MB, tracker.stages
+
+        print("[OK] Memory admission control works")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Memory admission test error: {e}")
+        return False
+
+def test_recategorize_from_store():
+    """Test storing OCR output and re-categorizing it without OCR"""
+    try:
+        import tempfile
+        from ocr_store import OCRStore
+        from recategorize import iter_recategorized
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = OCRStore(tmp)
+            document_id = store.save("Invoice No: INV-001\nTotal Amount: $10.00", [], filename='a.png', lang='eng')
+
+            record = store.load(document_id)
+            assert record['text'].startswith("Invoice No") and record['filename'] == 'a.png'
+            assert store.load('0' * 32) is None
+            assert store.load('../etc/passwd') is None
+            assert list(store.iter_paths()) == [store.path_for(document_id)]
+
+            results = list(iter_recategorized(store, workers=1))
+            assert results[0]['document_id'] == document_id
+            assert results[0]['result']['amount'] == ['$10.00']
+
+            results = list(iter_recategorized(store, [document_id, '0' * 32, 'not-an-id'], workers=1))
+            assert results[0] == {'document_id': 'not-an-id', 'error': 'Invalid document id'}
+            assert results[1]['document_id'] == document_id and 'result' in results[1]
+            assert results[2] == {'document_id': '0' * 32, 'error': 'Document not found'}
+
+            # The CLI fills in documents stored from a fields= upload
+            from document_store import DocumentStore
+            from recategorize import main as recategorize_main
+            db_path = os.path.join(tmp, 'documents.db')
+            documents = DocumentStore(db_path)
+            documents.add(document_id, {'amount': ['$10.00']}, record['text'], complete=False)
+            documents.close()
+            output = os.path.join(tmp, 'out.ndjson')
+            recategorize_main(['--store', tmp, '--update-db', db_path, '--incomplete-only',
+                               '--workers', '1', '--output', output])
+            with open(output, encoding='utf-8') as f:
+                assert [json.loads(line)['document_id'] for line in f] == [document_id]
+            documents = DocumentStore(db_path)
+            assert documents.incomplete_ids() == []
+            assert documents.search(fields={'amount': '$10.00'})['documents'][0]['document_type'] == 'invoice'
+            documents.close()
+
+        print("[OK] Re-categorization from stored OCR works")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Re-categorization test error: {e}")
+        return False
+
+def test_region_index():
+    """Test grid index hit-testing and region tagging from the stored text"""
+    try:
+        import tempfile
+        from ocr_store import OCRStore
+        from spatial_index import GridIndex, RegionIndexCache
+
+        def word(text, x, y, width=40, height=12):
+            return {'text': text, 'bbox': {'x': x, 'y': y, 'width': width, 'height': height}}
+
+        regions = [word('Total', 10, 10), word('Amount:', 60, 10), word('$10.00', 110, 10), word('Thanks', 10, 500)]
+        index = GridIndex(regions, cell_size=32)
+
+        assert [r['text'] for r in index.query_point(20, 15)] == ['Total']
+        assert index.query_point(1000, 1000) == []
+        assert [r['text'] for r in index.query_rect(0, 0, 200, 30)] == ['Total', 'Amount:', '$10.00']
+        # Huge rectangles are clamped to the occupied cells and still return OCR order
+        assert [r['text'] for r in index.query_rect(-1e9, -1e9, 2e9, 2e9)] == ['Total', 'Amount:', '$10.00', 'Thanks']
+        assert GridIndex([]).query_rect(0, 0, 1e9, 1e9) == []
+        try:
+            index.query_rect(0, 0, -1, 10)
+            raise AssertionError("negative width accepted")
+        except ValueError:
+            pass
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = OCRStore(tmp)
+            document_id = store.save("Total Amount: $10.00\nThanks", regions)
+            cache = RegionIndexCache(store)
+            index, record = cache.get(document_id)
+            assert [r['text'] for r in index.query_rect(0, 0, 1e6, 1e6, category='amount')] == ['$10.00']
+            # Line-level categories are never used as tags
+            assert index.regions[3]['category'] is None
+            assert cache.get('0' * 32) == (None, None)
+
+        # Tags come from match spans on each OCR line of the fake Vision invoice layout
+        from fake_vision import FakeVisionClient
+        from spatial_index import tag_regions
+        from text_categorizer import TextCategorizer
+
+        layout = []
+        for annotation in FakeVisionClient(latency_ms=0, jitter_ms=0).text_detection().text_annotations[1:]:
+            xs = [v.x for v in annotation.bounding_poly.vertices]
+            ys = [v.y for v in annotation.bounding_poly.vertices]
+            layout.append(word(annotation.description, min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)))
+        tags = {r['text']: r['category'] for r in tag_regions(layout, TextCategorizer())}
+        assert tags['$1,250.00'] == 'amount', tags
+        assert tags['INV-2024-0042'] == 'invoice_number', tags
+        assert tags['15/05/2024'] == 'date' and tags['081-234-5678'] == 'phone', tags
+        assert tags['john.doe@example.com'] == 'email', tags
+        assert tags['John'] == tags['Doe'] == 'name', tags
+        for label in ['TAX', 'INVOICE', 'Invoice', 'No:', 'Date:', 'Customer:', 'Total', 'Amount:', 'Item']:
+            assert tags[label] is None, (label, tags)
+
+        # A word repeated on another line only takes the tag where it matched
+        repeated = tag_regions([word('Customer:', 0, 0, 90), word('John', 100, 0), word('Doe', 150, 0),
+                                word('Ref:', 0, 40), word('Doe', 50, 40)], TextCategorizer())
+        assert [r['category'] for r in repeated] == [None, 'name', 'name', None, None]
+
+        print("[OK] Region index works")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Region index test error: {e}")
+        return False
+
+def test_single_flight():
+    """Test that concurrent identical calls share one execution, its result and its error"""
+    try:
+        import threading
+        from single_flight import SingleFlight
+
+        def run_concurrently(flight, fn, callers=4):
+            started = threading.Event()
+            release = threading.Event()
+            outcomes = []
+
+            def leader_fn():
+                started.set()
+                release.wait(5)
+                return fn()
+
+            def call(target):
+                try:
+                    outcomes.append(flight.do('key', target))
+                except Exception as e:
+                    outcomes.append(e)
+
+            threads = [threading.Thread(target=call, args=(leader_fn,))]
+            threads[0].start()
+            started.wait(5)
+            for _ in range(callers - 1):
+                threads.append(threading.Thread(target=call, args=(fn,)))
+                threads[-1].start()
+            # Waiters bump the coalesced counter before blocking on the leader
+            while flight.coalesced < callers - 1:
+                threading.Event().wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+            return outcomes
+
+        flight = SingleFlight()
+        outcomes = run_concurrently(flight, lambda: ['region'])
+        assert sorted(shared for _, shared in outcomes) == [False, True, True, True]
+        assert all(result == ['region'] for result, _ in outcomes)
+        assert flight.stats() == {'executed': 1, 'coalesced': 3, 'in_flight': 0}
+
+        def fail():
+            raise RuntimeError("ocr failed")
+
+        flight = SingleFlight()
+        outcomes = run_concurrently(flight, fail)
+        assert len(outcomes) == 4 and all(isinstance(e, RuntimeError) for e in outcomes)
+        assert flight.stats() == {'executed': 1, 'coalesced': 3, 'in_flight': 0}
+
+        # A finished key runs again rather than returning a stale result
+        assert flight.do('key', lambda: 'again') == ('again', False)
+
+        print("[OK] Single-flight coalescing works")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Single-flight test error: {e}")
+        return False
+
+def test_field_selection():
+    """Test that requesting a subset of fields returns the same values as a full pass"""
+    try:
+        from text_categorizer import TextCategorizer
+        categorizer = TextCategorizer()
+
+        sample_text = """
+        TAX INVOICE
+        Invoice No: INV-2023-0042
+        Invoice Date: 2023-05-15
+        john.doe@example.com
+        Total Amount: $1,250.00
+        """
+
+        full = categorizer.categorize_text(sample_text)
+        selected = categorizer.categorize_text(sample_text, fields=['amount', 'invoice_number'])
+
+        assert list(selected) == ['amount', 'invoice_number']
+        assert selected['amount'] == full['amount']
+        assert selected['invoice_number'] == full['invoice_number']
+        assert isinstance(full['document_type'], str)
+
+        print("[OK] Field selection matches the full categorization")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Field selection test error: {e}")
+        return False
+
+def test_document_store():
+    """Test that stored documents can be found by text and by extracted fields"""
+    try:
+        import tempfile
+        import sqlite3
+        from document_store import DocumentStore, SCHEMA
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = DocumentStore(os.path.join(tmp, 'documents.db'), flush_interval=0)
+            store.add('a' * 32, {'invoice_number': ['INV-001'], 'amount': ['$10.00'], 'document_type': 'invoice'},
+                      'Invoice INV-001 for consulting services')
+            store.add('b' * 32, {'invoice_number': ['INV-002'], 'amount': ['$10.00'], 'document_type': 'receipt'},
+                      'Receipt INV-002 for hardware')
+            store.flush()
+
+            assert [d['document_id'] for d in store.search(q='consulting')['documents']] == ['a' * 32]
+
+            # Thai has no spaces between words and unicode61 splits it at combining marks
+            store.add('e' * 32, {'document_type': 'invoice'}, 'ใบกำกับภาษีเลขที่ 123 บริษัทตัวอย่างจำกัด')
+            store.flush()
+            assert [d['document_id'] for d in store.search(q='บริษัท')['documents']] == ['e' * 32]
+            assert [d['document_id'] for d in store.search(q='ใบกำกับภาษี')['documents']] == ['e' * 32]
+            assert [d['document_id'] for d in store.search(fields={'invoice_number': 'INV-002'})['documents']] == ['b' * 32]
+
+            first_page = store.search(fields={'amount': '$10.00'}, limit=1)
+            second_page = store.search(fields={'amount': '$10.00'}, limit=1, cursor=first_page['next_cursor'])
+            assert [d['document_id'] for d in first_page['documents'] + second_page['documents']] == ['b' * 32, 'a' * 32]
+
+            # A partial (fields=) upload is stored as incomplete until it is re-categorized
+            store.add('c' * 32, {'amount': ['$30.00']}, 'Total Amount: $30.00', complete=False)
+            store.flush()
+            partial = store.search(fields={'amount': '$30.00'})['documents']
+            assert [(d['document_id'], d['document_type'], d['complete']) for d in partial] == [('c' * 32, None, False)]
+            assert store.incomplete_ids() == ['c' * 32]
+            store.update('c' * 32, {'amount': ['$30.00'], 'document_type': 'invoice'})
+            store.update('a' * 32, {'invoice_number': ['INV-101'], 'amount': [], 'document_type': 'receipt'})
+            store.flush()
+            assert store.incomplete_ids() == []
+            assert store.search(fields={'amount': '$30.00'})['documents'][0]['document_type'] == 'invoice'
+            assert store.search(fields={'invoice_number': 'INV-001'})['documents'] == []
+            updated = store.search(fields={'invoice_number': 'INV-101'})['documents']
+            assert [(d['document_id'], d['document_type']) for d in updated] == [('a' * 32, 'receipt')]
+            store.close()
+
+            # One bad document fails its batch, but the others are retried and stored
+            store = DocumentStore(os.path.join(tmp, 'retry.db'), flush_interval=0.2, max_queue=10)
+            assert store._queue.maxsize == 10
+            store.add('1' * 32, {'document_type': 'invoice'}, 'kept before')
+            store.add('2' * 32, {'document_type': object()}, 'not serializable')
+            store.add('3' * 32, {'document_type': 'invoice'}, 'kept after')
+            store.flush()
+            assert sorted(d['document_id'] for d in store.search(q='kept')['documents']) == ['1' * 32, '3' * 32]
+            store.close()
+
+            # A database indexed with the old unicode61 tokenizer is re-indexed on open
+            legacy_path = os.path.join(tmp, 'legacy.db')
+            with sqlite3.connect(legacy_path) as conn:
+                conn.executescript(SCHEMA.replace(", tokenize='trigram'", ''))
+                conn.execute("INSERT INTO documents (document_id, created_at, text, result) VALUES (?, ?, ?, ?)",
+                             ('f' * 32, '2024-01-01', 'บริษัทตัวอย่างจำกัด', '{}'))
+                conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+            conn.close()
+            legacy = DocumentStore(legacy_path)
+            assert [d['document_id'] for d in legacy.search(q='บริษัท')['documents']] == ['f' * 32]
+            legacy.close()
+
+            # A steady trickle of documents must not hold a batch open past one flush interval
+            store = DocumentStore(os.path.join(tmp, 'trickle.db'), flush_interval=0.2)
+            start = time.monotonic()
+            store.add('d' * 32, {'document_type': 'invoice'}, 'first of a trickle')
+            while time.monotonic() - start < 1.0:
+                store.add(uuid.uuid4().hex, {'document_type': 'invoice'}, 'trickle')
+                time.sleep(0.05)
+            assert store.search(q='first')['documents'], "batch was held open by the trickle"
+            store.close()
+
+        print("[OK] Document store search works")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Document store test error: {e}")
+        return False
+
+def test_parallel_categorization():
+    """Test that section-parallel categorization matches the serial result"""
+    try:
+        from text_categorizer import TextCategorizer
+        categorizer = TextCategorizer()
+
+        lines = ["SERVICE AGREEMENT"]
+        for i in range(1, 9):
+            lines.append(f"Article {i} Terms")
+            lines.extend(["Payment of $1,250.00 due 15/05/2024", "Contact: legal@example.com", f"Clause text {i}"])
+        sample_text = '\n'.join(lines)
+
+        serial = categorizer.categorize_text(sample_text)
+        parallel = categorizer.categorize_text_parallel(sample_text, workers=2, min_chunk_lines=4)
+
+        assert parallel == serial
+        assert list(parallel['sections']) == list(serial['sections'])
+
+        print("[OK] Parallel categorization matches serial")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Parallel categorization test error: {e}")
+        return False
+
 def main():
     print("Testing OCR Document Categorizer Backend...")
     print()
@@ -52,6 +467,14 @@ def main():
     success = True
     success &= test_imports()
     success &= test_basic_functions()
+    success &= test_tiling()
+    success &= test_memory_admission()
+    success &= test_recategorize_from_store()
+    success &= test_region_index()
+    success &= test_single_flight()
+    success &= test_field_selection()
+    success &= test_document_store()
+    success &= test_parallel_categorization()
     
     print()
     if success: